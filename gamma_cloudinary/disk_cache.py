@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import tempfile
+
+#prefix of the temporary files being written to the cache directory
+TEMPORARY_PREFIX = '.tmp-'
+
+
+class DiskCache:
+    """
+    A size bounded cache of downloaded files on the local disk.
+
+    Every entry is kept in a single file holding a JSON line of validators
+    (ETag and Last-Modified) followed by the file content. Entries are written
+    to a temporary file and atomically moved in place so that concurrent
+    processes never read a partially written entry. Once the entries exceed
+    max_size bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+        os.makedirs(location, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.location, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """
+        Get a cached entry.
+
+        Arguments:
+        key(string): The key of the entry e.g. the url of the downloaded file.
+
+        Returns:
+        tuple: The validators (dict) and content (bytes) of the entry or None if it is not cached.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                validators = json.loads(f.readline().decode('utf-8'))
+                content = f.read()
+            # mark the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return validators, content
+
+    def set(self, key, content, validators):
+        """
+        Cache the content of a downloaded file along with its validators and
+        evict the least recently used entries if the cache is full.
+        """
+        if len(content) > self.max_size:
+            return
+        fd, temporary_path = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=self.location)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(validators).encode('utf-8') + b'\n')
+                f.write(content)
+            os.replace(temporary_path, self.path(key))
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_size bytes."""
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.location):
+            if entry.name.startswith(TEMPORARY_PREFIX) or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        for _mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,21 @@
+from django.db.models.fields.files import ImageField, ImageFieldFile
+from gamma_cloudinary.storage import CloudinaryStorage
+
+
+class CloudinaryImageFieldFile(ImageFieldFile):
+    """
+    ImageFieldFile that reads the dimensions of images stored on Cloudinary
+    from their upload metadata instead of downloading the image.
+    """
+
+    def _get_image_dimensions(self):
+        if not hasattr(self, '_dimensions_cache') and self._committed and isinstance(self.storage, CloudinaryStorage):
+            dimensions = self.storage.get_image_dimensions(self.name)
+            if None not in dimensions:
+                self._dimensions_cache = dimensions
+        return super()._get_image_dimensions()
+
+
+class CloudinaryImageField(ImageField):
+    """ImageField whose width and height are served from Cloudinary upload metadata."""
+    attr_class = CloudinaryImageFieldFile
@@ -0,0 +1,202 @@
+import os
+import json
+import cloudinary
+import cloudinary.api
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.apps import apps
+from django.db import models
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.staticfiles.storage import staticfiles_storage
+from gamma_cloudinary.storage import CloudinaryStorage
+from gamma_cloudinary.utils import find_static_files
+
+#resource types under which assets may have been uploaded
+RESOURCE_TYPES = ('image', 'video', 'raw')
+
+#maximum number of public_ids accepted by a single delete_resources admin api call
+MAX_BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete assets stored on Cloudinary under the static (or media) base_url "
+        "that no longer exist locally, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help="Do NOT prompt the user for input of any kind.",
+        )
+        parser.add_argument(
+            '--media', action='store_true',
+            help="Prune media assets not referenced by any FileField instead of static assets.",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="List the orphaned assets without deleting them.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=MAX_BATCH_SIZE,
+            help="Number of assets deleted per api call (at most %d)." % MAX_BATCH_SIZE,
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help="Maximum number of concurrent delete api calls.",
+        )
+        parser.add_argument(
+            '--report',
+            help="Path of a JSON file to write the orphaned and deleted public_ids to.",
+        )
+        parser.add_argument(
+            '--state-file',
+            help="Path of a JSON file used to record progress. When it exists, "
+                 "pruning resumes from it instead of listing the remote assets again.",
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= options['batch_size'] <= MAX_BATCH_SIZE:
+            raise CommandError('--batch-size must be between 1 and %d.' % MAX_BATCH_SIZE)
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        storage = default_storage if options['media'] else staticfiles_storage
+        if not isinstance(storage, CloudinaryStorage):
+            raise CommandError('The %s storage is not a CloudinaryStorage.' % ('media' if options['media'] else 'static'))
+
+        local = self.media_public_ids(storage) if options['media'] else self.static_public_ids(storage)
+        state_file = options['state_file']
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            self.stdout.write('Resuming from %s.' % state_file)
+            # files may have been added back locally since the state was saved
+            for resource_type, public_ids in state['orphans'].items():
+                deleted = set(state['deleted'].get(resource_type, []))
+                state['orphans'][resource_type] = [
+                    public_id for public_id in public_ids
+                    if public_id in deleted or public_id not in local
+                ]
+        else:
+            state = {'orphans': self.find_orphans(storage, local), 'deleted': {}}
+
+        if options['dry_run'] or options['verbosity'] >= 2:
+            for resource_type, public_ids in state['orphans'].items():
+                for public_id in public_ids:
+                    self.stdout.write('Orphaned %s (%s)' % (public_id, resource_type))
+
+        pending = sum(
+            len(set(public_ids) - set(state['deleted'].get(resource_type, [])))
+            for resource_type, public_ids in state['orphans'].items()
+        )
+        if not options['dry_run'] and pending and options['interactive']:
+            message = (
+                "\nYou have requested to delete %d assets stored on Cloudinary under %s "
+                "that do not exist locally.\n\n"
+                "This will DELETE them permanently!\n"
+                "Are you sure you want to do this?\n\n"
+                "Type 'yes' to continue, or 'no' to cancel: " % (pending, storage.base_url)
+            )
+            if input(message) != 'yes':
+                raise CommandError("Pruning cancelled.")
+
+        if not options['dry_run']:
+            # only saved once confirmed so that a cancelled run is not resumed later
+            self.save_state(state_file, state)
+            self.delete_orphans(state, options['batch_size'], options['workers'], state_file)
+
+        orphaned = sum(len(public_ids) for public_ids in state['orphans'].values())
+        deleted = sum(len(public_ids) for public_ids in state['deleted'].values())
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(dict(state, dry_run=options['dry_run']), f, indent=2)
+        if options['dry_run']:
+            self.stdout.write('%d orphaned assets found.' % orphaned)
+        elif deleted < orphaned:
+            raise CommandError(
+                '%d of %d orphaned assets could not be deleted. '
+                'Run the command again to retry.' % (orphaned - deleted, orphaned)
+            )
+        else:
+            if state_file and os.path.exists(state_file):
+                os.remove(state_file)
+            self.stdout.write(self.style.SUCCESS('%d orphaned assets deleted.' % deleted))
+
+    def static_public_ids(self, storage):
+        """Return the public_ids of the static files collected by the staticfiles finders."""
+        return {storage.public_id(name) for name in find_static_files()}
+
+    def media_public_ids(self, storage):
+        """Return the public_ids of the files referenced by FileFields stored on the given storage."""
+        public_ids = set()
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, models.FileField):
+                    continue
+                if not isinstance(field.storage, CloudinaryStorage) or field.storage.base_url != storage.base_url:
+                    continue
+                names = model._default_manager.exclude(**{field.attname: ''}).exclude(
+                    **{'%s__isnull' % field.attname: True}
+                ).values_list(field.attname, flat=True)
+                for name in names.iterator():
+                    public_ids.add(field.storage.public_id(name))
+        return public_ids
+
+    def find_orphans(self, storage, local_public_ids):
+        """Return the remote public_ids under the storage base_url, per resource_type, missing locally."""
+        orphans = {}
+        for resource_type in RESOURCE_TYPES:
+            next_cursor = None
+            while True:
+                options = {
+                    'resource_type': resource_type,
+                    'type': 'upload',
+                    'prefix': storage.base_url.lstrip('/'),
+                    'max_results': 500,
+                }
+                if next_cursor:
+                    options['next_cursor'] = next_cursor
+                response = cloudinary.api.resources(**options)
+                for resource in response['resources']:
+                    if resource['public_id'] not in local_public_ids:
+                        orphans.setdefault(resource_type, []).append(resource['public_id'])
+                next_cursor = response.get('next_cursor')
+                if not next_cursor:
+                    break
+        return orphans
+
+    def delete_orphans(self, state, batch_size, workers, state_file):
+        """Delete the orphans not yet deleted in batches, recording progress in the state."""
+        batches = []
+        for resource_type, public_ids in state['orphans'].items():
+            deleted = set(state['deleted'].get(resource_type, []))
+            pending = [public_id for public_id in public_ids if public_id not in deleted]
+            for start in range(0, len(pending), batch_size):
+                batches.append((resource_type, pending[start:start + batch_size]))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(cloudinary.api.delete_resources, public_ids, resource_type=resource_type): (resource_type, public_ids)
+                for resource_type, public_ids in batches
+            }
+            for future in as_completed(futures):
+                resource_type, public_ids = futures[future]
+                try:
+                    response = future.result()
+                except cloudinary.exceptions.Error as e:
+                    self.stderr.write('Failed to delete a batch of %s assets: %s' % (resource_type, e))
+                    continue
+                deleted = [
+                    public_id for public_id in public_ids
+                    if response['deleted'].get(public_id) in ('deleted', 'not_found')
+                ]
+                state['deleted'].setdefault(resource_type, []).extend(deleted)
+                self.save_state(state_file, state)
+
+    def save_state(self, state_file, state):
+        """Atomically write the pruning progress to the state file, if any."""
+        if state_file:
+            with open(state_file + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(state_file + '.tmp', state_file)
@@ -0,0 +1,208 @@
+import re
+import json
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.staticfiles.storage import staticfiles_storage
+from gamma_cloudinary.utils import find_static_files, get_resource_type
+
+#matches the cloudinary delivery urls found in access logs
+CLOUDINARY_URL_PATTERN = re.compile(r'https?://[^\s"\']*cloudinary\.com/[^\s"\']+')
+
+#Accept headers of the clients whose formats are negotiated by f_auto
+DEFAULT_ACCEPT_HEADERS = (
+    'image/avif,image/webp,image/*,*/*;q=0.8',
+    'image/webp,image/*,*/*;q=0.8',
+    'image/*,*/*;q=0.8',
+)
+
+
+class RateLimiter:
+    """Spaces out the calls to wait() so that at most rate calls happen per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = (
+        "Request the delivery urls of static and media assets so that their derived "
+        "versions are generated and cached by the CDN before real traffic hits them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-static', action='store_false', dest='static',
+            help="Do not warm the urls of the static files found by the staticfiles finders.",
+        )
+        parser.add_argument(
+            '--options',
+            help="Path of a JSON file holding a list of url option sets, as passed to the "
+                 "gamma_cl_static template tag, to warm each static image with.",
+        )
+        parser.add_argument(
+            '--access-log', action='append', default=[],
+            help="Path of an access log to warm the cloudinary urls found in. Can be repeated.",
+        )
+        parser.add_argument(
+            '--sample', type=int,
+            help="Warm a random sample of at most this many of the urls found in the access logs.",
+        )
+        parser.add_argument(
+            '--accept', action='append',
+            help="Accept header to request f_auto urls with. Can be repeated. "
+                 "Defaults to the headers of AVIF, WebP and other image capable clients.",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="Maximum number of concurrent requests.",
+        )
+        parser.add_argument(
+            '--rate', type=float, default=20,
+            help="Maximum number of requests per second. 0 disables rate limiting.",
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help="Timeout of every request in seconds.",
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        urls = self.find_urls(options)
+        accept_headers = options['accept'] or DEFAULT_ACCEPT_HEADERS
+        requests_to_send = [
+            (url, accept)
+            for url in sorted(urls)
+            for accept in (accept_headers if 'f_auto' in url else (None,))
+        ]
+        if not requests_to_send:
+            self.stdout.write('No urls to warm.')
+            return
+
+        rate_limiter = RateLimiter(options['rate'])
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=options['workers'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            def warm(request):
+                url, accept = request
+                rate_limiter.wait()
+                return self.warm_url(session, url, accept, options['timeout'])
+
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(warm, requests_to_send))
+
+        self.report(results, options['verbosity'])
+
+    def find_urls(self, options):
+        """Return the set of urls to warm."""
+        urls = set()
+        if options['static']:
+            option_sets = [{}]
+            if options['options']:
+                with open(options['options']) as f:
+                    option_sets = json.load(f)
+                if not isinstance(option_sets, list) or not all(isinstance(o, dict) for o in option_sets):
+                    raise CommandError('--options must be a JSON list of objects.')
+            for name in find_static_files():
+                # transformations only apply to images, other files are served as is
+                if get_resource_type(name) != 'image':
+                    urls.add(staticfiles_storage.url(name))
+                    continue
+                for option_set in option_sets:
+                    urls.add(staticfiles_storage.url(name, **option_set))
+
+        logged_urls = set()
+        for access_log in options['access_log']:
+            with open(access_log, errors='replace') as f:
+                for line in f:
+                    logged_urls.update(CLOUDINARY_URL_PATTERN.findall(line))
+        if options['sample'] is not None and len(logged_urls) > options['sample']:
+            logged_urls = random.sample(sorted(logged_urls), options['sample'])
+        urls.update(logged_urls)
+        return urls
+
+    def warm_url(self, session, url, accept, timeout):
+        """
+        Request a url and return the outcome
+
+        Returns:
+        dict: The url, Accept header, status code, CDN cache status and time to first byte in seconds of the request
+        """
+        headers = {'Accept': accept} if accept else {}
+        start = time.monotonic()
+        try:
+            # stream the body so the latency measures the time to first byte
+            with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                latency = time.monotonic() - start
+                # drain the body without keeping it in memory so that the connection
+                # goes back to the pool instead of being reset
+                for _chunk in response.iter_content(65536):
+                    pass
+        except requests.RequestException as e:
+            return {'url': url, 'accept': accept, 'status': None, 'cache': None, 'latency': None, 'error': str(e)}
+        return {
+            'url': url,
+            'accept': accept,
+            'status': response.status_code,
+            'cache': self.cache_status(response.headers),
+            'latency': latency,
+            'error': None,
+        }
+
+    def cache_status(self, headers):
+        """Return 'hit' or 'miss' from the CDN cache headers of a response or None if unknown."""
+        status = headers.get('X-Cache') or headers.get('CF-Cache-Status') or ''
+        # e.g. X-Cache: "HIT, MISS" when served through several cache layers
+        status = status.split(',')[-1].strip().upper()
+        if status.startswith('HIT'):
+            return 'hit'
+        if status.startswith('MISS') or status == 'EXPIRED':
+            return 'miss'
+        return None
+
+    def report(self, results, verbosity):
+        if verbosity >= 2:
+            for result in results:
+                self.stdout.write('%s %s %s %s%s' % (
+                    result['status'] or 'ERROR',
+                    result['cache'] or '-',
+                    '%.0fms' % (result['latency'] * 1000) if result['latency'] is not None else '-',
+                    result['url'],
+                    ' (%s)' % result['accept'] if result['accept'] else '',
+                ))
+
+        errors = [result for result in results if result['error'] or result['status'] >= 400]
+        for result in errors:
+            self.stderr.write('Failed to warm %s: %s' % (result['url'], result['error'] or result['status']))
+
+        latencies = sorted(result['latency'] for result in results if result['latency'] is not None)
+        summary = '%d requests: %d hits, %d misses, %d errors.' % (
+            len(results),
+            sum(1 for result in results if result['cache'] == 'hit'),
+            sum(1 for result in results if result['cache'] == 'miss'),
+            len(errors),
+        )
+        if latencies:
+            summary += ' Latency p50 %.0fms, p95 %.0fms, max %.0fms.' % (
+                latencies[len(latencies) // 2] * 1000,
+                latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                latencies[-1] * 1000,
+            )
+        self.stdout.write(self.style.SUCCESS(summary) if not errors else summary)
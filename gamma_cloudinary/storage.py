@@ -1,21 +1,60 @@
 import os
 import re
+import base64
+import hashlib
+import calendar
 import requests
 import posixpath
 import cloudinary
+import cloudinary.api
 from datetime import datetime
-from urllib.parse import unquote, urlparse
+from contextlib import contextmanager
+from asgiref.local import Local
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote, urlparse
 from django.conf import settings
 from django.utils import timezone
+from django.core.cache import caches
+from django.utils.http import http_date
 from django.core.files.storage import Storage
 from django.core.files.base import ContentFile
-from django.core.signals import setting_changed
+from django.core.files.utils import validate_file_name
+from django.core.signals import request_finished, setting_changed
 from django.utils.encoding import filepath_to_uri
 from django.utils.functional import cached_property
 from django.utils.deconstruct import deconstructible
 from django.core.exceptions import SuspiciousFileOperation
 from django.contrib.staticfiles.utils import matches_patterns, check_settings
-from gamma_cloudinary.utils import value_or_setting, get_resource_type
+from gamma_cloudinary.utils import value_or_setting, get_resource_type, get_mime_type
+from gamma_cloudinary.url_builder import CloudinaryUrlBuilder
+from gamma_cloudinary.disk_cache import DiskCache
+
+#mime types inlined as data URIs by default when rewriting css files
+INLINE_ASSET_MIME_TYPES = (
+    'image/svg+xml',
+    'image/png',
+    'image/gif',
+    'image/jpeg',
+    'image/webp',
+    'font/woff',
+    'font/woff2',
+)
+
+#matches the upload version prefixed to stored names when versioned urls are enabled
+VERSIONED_NAME_PATTERN = re.compile(r'^v(\d+)/(.+)$')
+
+#room reserved for the upload version prefix e.g. v1570979139/ when truncating versioned names
+VERSION_PREFIX_MAX_LENGTH = 12
+
+#maximum number of public_ids accepted by a single resources_by_ids admin api call
+PREFETCH_CHUNK_SIZE = 100
+
+#number of concurrent HEAD requests used when the admin api lookup is unavailable
+PREFETCH_MAX_WORKERS = 10
+
+#metadata index entry of files whose admin api lookup failed and how long it is kept in seconds
+MISSING_METADATA = ()
+MISSING_METADATA_TIMEOUT = 300
 
 @deconstructible
 class CloudinaryStorage(Storage):
@@ -27,7 +66,9 @@ class CloudinaryStorage(Storage):
     def __init__(self, location=None, base_url=None, options=None):
         self._base_location = location
         self._base_url = base_url
+        self._prefetched = Local()
         setting_changed.connect(self._clear_cached_properties)
+        request_finished.connect(self.clear_prefetched)
 
     def _clear_cached_properties(self, setting, **kwargs):
         """Reset setting based property values."""
@@ -35,6 +76,9 @@ class CloudinaryStorage(Storage):
             self.__dict__.pop('base_location', None)
         elif setting == 'MEDIA_URL':
             self.__dict__.pop('base_url', None)
+        elif setting == 'CLOUDINARY_STORAGE':
+            self.__dict__.pop('open_cache', None)
+            self.__dict__.pop('url_builder', None)
 
     @cached_property
     def base_location(self):
@@ -57,6 +101,67 @@ class CloudinaryStorage(Storage):
             value_or_setting(self._base_url, settings.MEDIA_URL).lstrip('/'),
             '').replace('\\', '/')
 
+    @cached_property
+    def url_builder(self):
+        """ The builder used to generate the urls to the media/static files """
+        return CloudinaryUrlBuilder()
+
+    @cached_property
+    def open_cache(self):
+        """
+        The local disk cache of the files downloaded by _open() or None if disabled.
+        Controlled by CLOUDINARY_STORAGE['OPEN_CACHE_DIR'] and CLOUDINARY_STORAGE['OPEN_CACHE_MAX_SIZE'].
+        """
+        location = settings.CLOUDINARY_STORAGE.get('OPEN_CACHE_DIR')
+        if not location:
+            return None
+        return DiskCache(location, settings.CLOUDINARY_STORAGE.get('OPEN_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+
+    @property
+    def metadata_cache(self):
+        """
+        The cache used as the index of the upload metadata (dimensions, format
+        and size) of stored files or None if disabled. Controlled by
+        CLOUDINARY_STORAGE['METADATA_CACHE'], which must name a cache shared by
+        all processes that persists across restarts e.g. a database or redis cache.
+        """
+        alias = settings.CLOUDINARY_STORAGE.get('METADATA_CACHE')
+        if not alias:
+            return None
+        return caches[alias]
+
+    @property
+    def versioned_urls(self):
+        """
+        Whether the upload version is kept alongside stored names so that
+        url() builds versioned urls. Controlled by CLOUDINARY_STORAGE['VERSIONED_MEDIA_URLS'].
+        """
+        return settings.CLOUDINARY_STORAGE.get('VERSIONED_MEDIA_URLS', False)
+
+    def split_version(self, name):
+        """
+        Split the upload version off a stored name.
+
+        Arguments:
+        name(string): The stored name e.g. v1570979139/images/test.jpg
+
+        Returns:
+        tuple: The version (or None if the name is not versioned) and the name without it.
+        """
+        match = VERSIONED_NAME_PATTERN.match(name.replace('\\', '/'))
+        if match is None:
+            return None, name
+        return match.group(1), match.group(2)
+
+    @property
+    def _prefetched_metadata(self):
+        """ The metadata resolved by prefetch() in the current thread or asyncio task """
+        try:
+            return self._prefetched.metadata
+        except AttributeError:
+            self._prefetched.metadata = {}
+            return self._prefetched.metadata
+
     def exists(self, name):
         """
         Check wether a file exists in storage
@@ -69,27 +174,128 @@ class CloudinaryStorage(Storage):
         It raises an exception incase a http error other than 404
         is encountered while querying Cloudinary.
         """
-        url = self.url(name)
-        response = requests.head(url)
-        if response.status_code == 404:
-            return False
-        response.raise_for_status()
-        return True
+        return self.get_file_metadata(name) is not None
 
     def get_file_metadata(self, name):
         """
         Probe Cloudinary servers for metadata about a resource and
         return this metadata e.g. file last modified time.
+
+        Metadata resolved by prefetch() is returned without querying Cloudinary.
         """
-        response = requests.head(self.url(name))
+        if name in self._prefetched_metadata:
+            return self._prefetched_metadata[name]
+        response = requests.head(self._original_url(name))
         if response.status_code == 404:
             return None
         response.raise_for_status()
         return response.headers
 
+    def prefetch(self, names):
+        """
+        Resolve the metadata of many files at once so that subsequent calls to
+        exists(), size() and get_modified_time() for these files do not query
+        Cloudinary one file at a time. Prefetched metadata is only visible to
+        the current thread (or asyncio task) and is discarded at the end of
+        every request. Outside of requests, use prefetched() or clear_prefetched().
+
+        Metadata is looked up through the admin api in chunks of public_ids
+        per resource_type, falling back to concurrent HEAD requests when the
+        admin api is unavailable e.g. due to rate limiting.
+
+        Arguments:
+        names(iterable): The names of the target files.
+
+        Returns:
+        list: The names whose metadata was resolved by this call.
+        """
+        names = [name for name in set(names) if name and name not in self._prefetched_metadata]
+        if not names:
+            return []
+        try:
+            metadata = self._fetch_resources_metadata(names)
+        except cloudinary.exceptions.Error:
+            metadata = self._fetch_headers_metadata(names)
+        self._prefetched_metadata.update(metadata)
+        return names
+
+    @contextmanager
+    def prefetched(self, names):
+        """
+        Prefetch the metadata of the given files for the duration of a with
+        block e.g. in management commands or background tasks.
+        """
+        names = self.prefetch(names)
+        try:
+            yield
+        finally:
+            for name in names:
+                self._prefetched_metadata.pop(name, None)
+
+    def clear_prefetched(self, **kwargs):
+        """Discard the metadata resolved by prefetch() in the current thread or asyncio task."""
+        self._prefetched_metadata.clear()
+
+    def _fetch_resources_metadata(self, names):
+        """
+        Look up the metadata of the given files through the admin api.
+
+        Returns:
+        dict: The header-like metadata of each name, or None for missing files.
+        """
+        public_ids = {}
+        for name in names:
+            public_id = self.public_id(name)
+            # names only differing by their extension e.g. a.jpg and a.png share a public_id
+            public_ids.setdefault(get_resource_type(name), {}).setdefault(public_id, []).append(name)
+
+        metadata = dict.fromkeys(names)
+        for resource_type, names_by_id in public_ids.items():
+            ids = list(names_by_id)
+            for start in range(0, len(ids), PREFETCH_CHUNK_SIZE):
+                chunk = ids[start:start + PREFETCH_CHUNK_SIZE]
+                response = cloudinary.api.resources_by_ids(
+                    chunk,
+                    resource_type=resource_type,
+                    max_results=len(chunk)
+                )
+                for resource in response['resources']:
+                    created_at = datetime.strptime(resource['created_at'], '%Y-%m-%dT%H:%M:%SZ')
+                    for name in names_by_id.get(resource['public_id'], []):
+                        metadata[name] = {
+                            'Content-Length': str(resource['bytes']),
+                            'Last-Modified': http_date(calendar.timegm(created_at.utctimetuple())),
+                        }
+        return metadata
+
+    def _fetch_headers_metadata(self, names):
+        """
+        Look up the metadata of the given files through concurrent HEAD
+        requests sharing a pool of connections.
+
+        Returns:
+        dict: The headers of each name, or None for missing files.
+        """
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=PREFETCH_MAX_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            def head(name):
+                response = session.head(self._original_url(name))
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                return response.headers
+
+            with ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS) as executor:
+                return dict(zip(names, executor.map(head, names)))
+
     def size(self, name):
         """
         Return the total size, in bytes, of the file specified by name.
+        This is the size of the uploaded original, not of the derived
+        versions served by url().
 
         Arguments:
         name -- The name of the target resource on Cloudinary
@@ -98,8 +304,8 @@ class CloudinaryStorage(Storage):
         integer: The size in bytes of the target resource
         """
         file_metada = self.get_file_metadata(name)
-        if bool(file_metada) and hasattr(file_metada, 'Content-Length'):
-            return file_metada['Content-Length']
+        if bool(file_metada) and 'Content-Length' in file_metada:
+            return int(file_metada['Content-Length'])
         return None
 
     def _open(self, name, mode='rb'):
@@ -114,12 +320,38 @@ class CloudinaryStorage(Storage):
         file: A File object or raises an exception if the file does not exist
         """
         url = self.url(name)
-        response = requests.get(url)
+        if self.open_cache is None:
+            response = requests.get(url)
+        else:
+            cached = self.open_cache.get(url)
+            if cached is not None:
+                validators, content = cached
+                # versioned urls always point to the same content
+                if self.versioned_urls and self.split_version(name)[0] is not None:
+                    return ContentFile(content, name=name)
+                headers = {}
+                if validators.get('ETag'):
+                    headers['If-None-Match'] = validators['ETag']
+                if validators.get('Last-Modified'):
+                    headers['If-Modified-Since'] = validators['Last-Modified']
+                response = requests.get(url, headers=headers)
+                if response.status_code == 304:
+                    return ContentFile(content, name=name)
+            else:
+                response = requests.get(url)
 
         if response.status_code == 404:
+            if self.open_cache is not None:
+                self.open_cache.delete(url)
             return None
         response.raise_for_status()
 
+        if self.open_cache is not None:
+            self.open_cache.set(url, response.content, {
+                'ETag': response.headers.get('ETag'),
+                'Last-Modified': response.headers.get('Last-Modified'),
+            })
+
         file = ContentFile(response.content)
         file.name = name
         return file
@@ -138,25 +370,127 @@ class CloudinaryStorage(Storage):
         #Do not attempt to upload empty files
         if content.size <= 0:
             return None
+        return self._upload(name, content, use_filename=True, unique_filename=False)
 
-        options = {
-            'use_filename': True,
+    def save_from_url(self, name, url, max_length=None):
+        """
+        Saves a remote file to cloudinary storage. Cloudinary fetches the file
+        from the url directly so its content never goes through Django.
+
+        Arguments:
+        name (string): The name to save the file as
+        url (string): The url of the remote file
+        max_length (int): The maximum length of the name. Defaults to None.
+
+        Returns:
+        string: The name of the saved file, e.g. to assign to a FileField
+
+        Raises ValueError if url is not a http(s) url. The uploader would
+        otherwise read any other string as a path to a local file and upload it.
+        """
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise ValueError('Only http and https urls can be saved, got %r.' % url)
+        name = self.get_available_name(name, max_length=max_length)
+        public_id = os.path.basename(name.replace('\\', '/'))
+        if get_resource_type(name) != 'raw':
+            public_id = os.path.splitext(public_id)[0]
+        name = self._upload(name, url, public_id=public_id)
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def _upload(self, name, file, **options):
+        """
+        Uploads a file object or remote url to cloudinary storage under the given name
+
+        Returns:
+        string: the name of the file uploaded to cloudinary
+        """
+        options = dict({
             'resource_type': get_resource_type(name),
-            'unique_filename': False,
             'overwrite': True,
-            'invalidate': True
-            }
+            #versioned urls change on every upload so there is no stale copy to purge
+            'invalidate': not self.versioned_urls
+            }, **options)
         folder, name = os.path.split(self.upload_path(name))
         if folder:
             options['folder'] = folder
-        response = cloudinary.uploader.upload(content, **options)
+        response = cloudinary.uploader.upload(file, **options)
         if settings.MEDIA_ROOT == self.base_location and response['resource_type'] in ['image', 'video', 'audio']:
             response['public_id'] = "%s.%s"%(response['public_id'], response['format'])
-        return response['public_id'].split('media/', 1)[-1]
+        name = response['public_id'].split('media/', 1)[-1]
+        self._prefetched_metadata.pop(name, None)
+        if self.versioned_urls:
+            name = "v%s/%s"%(response['version'], name)
+        self.set_upload_metadata(name, response)
+        return name
+
+    def _metadata_key(self, name):
+        return 'gamma_cloudinary:%s' % hashlib.md5(self.public_id(name).encode('utf-8')).hexdigest()
+
+    def set_upload_metadata(self, name, resource):
+        """
+        Keep the dimensions, format and size of a stored file in the metadata index.
+
+        Arguments:
+        name(string): The name of the stored file.
+        resource(dict): The upload response or admin api resource of the file.
+        """
+        if self.metadata_cache is None:
+            return
+        self.metadata_cache.set(
+            self._metadata_key(name),
+            (resource.get('width'), resource.get('height'), resource.get('format'), resource.get('bytes')),
+            None
+        )
+
+    def get_upload_metadata(self, name):
+        """
+        Get the dimensions, format and size of a stored file from the metadata
+        index, falling back to the admin api for files missing from it.
+
+        Arguments:
+        name(string): The name of the stored file.
+
+        Returns:
+        dict: The width, height, format and bytes of the file or None if it does
+        not exist, the admin api is unavailable e.g. due to rate limiting or the
+        metadata index is disabled. Failed lookups are not retried for
+        MISSING_METADATA_TIMEOUT seconds.
+        """
+        if self.metadata_cache is None:
+            return None
+        metadata = self.metadata_cache.get(self._metadata_key(name))
+        if metadata == MISSING_METADATA:
+            return None
+        if metadata is None:
+            try:
+                resource = cloudinary.api.resource(self.public_id(name), resource_type=get_resource_type(name))
+            except cloudinary.exceptions.Error:
+                # remember the failure for a while so that missing files do not cost an api call every time
+                self.metadata_cache.set(self._metadata_key(name), MISSING_METADATA, MISSING_METADATA_TIMEOUT)
+                return None
+            self.set_upload_metadata(name, resource)
+            metadata = (resource.get('width'), resource.get('height'), resource.get('format'), resource.get('bytes'))
+        return dict(zip(('width', 'height', 'format', 'bytes'), metadata))
+
+    def get_image_dimensions(self, name):
+        """
+        Return the (width, height) of a stored image without downloading it.
+        (None, None) is returned when the dimensions are not known.
+        """
+        metadata = self.get_upload_metadata(name)
+        if metadata is None:
+            return None, None
+        return metadata['width'], metadata['height']
 
     def delete(self, name):
         assert name, "The name argument is not allowed to be empty."
+        self._prefetched_metadata.pop(name, None)
+        if self.metadata_cache is not None:
+            self.metadata_cache.delete(self._metadata_key(name))
         name = self.url(name)
+        if self.open_cache is not None:
+            self.open_cache.delete(name)
         options = {
             'invalidate': True
         }
@@ -176,12 +510,13 @@ class CloudinaryStorage(Storage):
         string: The url to use to access the target resource on Cloudinary
 
         """
+        if self.versioned_urls:
+            version, name = self.split_version(name)
+            if version is not None:
+                options.setdefault('version', version)
         url = filepath_to_uri(name).lstrip('/')
-        cloudinary_resource = cloudinary.CloudinaryResource(
-            self.upload_path(url),
-            default_resource_type=get_resource_type(name)
-        )
-        if cloudinary_resource.resource_type == 'image' and 'quality' not in options:
+        resource_type = get_resource_type(name)
+        if resource_type == 'image' and 'quality' not in options:
             options = dict(
                 {
                     'quality': settings.CLOUDINARY_STORAGE.get('DEFAULT_IMAGE_QUALITY', 'auto'),
@@ -191,9 +526,32 @@ class CloudinaryStorage(Storage):
                 },
                 **options
                 )
-        if 'ckeditor' in url:
-            print(url, cloudinary_resource.build_url(**options))
-        return cloudinary_resource.build_url(**options)
+        return self.url_builder.build_url(self.upload_path(url), default_resource_type=resource_type, **options)
+
+    def _original_url(self, name):
+        """
+        Get the url of the uploaded original of a resource, without the default
+        image transformations, so that its headers describe the stored file.
+        """
+        return self.url(name, quality=None)
+
+    def public_id(self, name):
+        """
+        Get the public_id of a stored resource from its name.
+
+        Arguments:
+        name(string): the name of the target resource.
+
+        Returns:
+        string: the public_id of the resource on Cloudinary. Only raw resources
+        keep their file extension as part of the public_id.
+        """
+        if self.versioned_urls:
+            _version, name = self.split_version(name)
+        public_id = self.upload_path(name)
+        if get_resource_type(name) != 'raw':
+            public_id = os.path.splitext(public_id)[0]
+        return public_id
 
     def upload_path(self, name):
         """
@@ -226,6 +584,9 @@ class CloudinaryStorage(Storage):
         """
         if max_length is None:
             return name
+        if self.versioned_urls:
+            # the upload version is prefixed to the name once it is saved
+            max_length -= VERSION_PREFIX_MAX_LENGTH
         # Truncate name if max_length exceeded.
         truncation = len(name) - max_length
         if truncation > 0:
@@ -245,8 +606,14 @@ class CloudinaryStorage(Storage):
         name. The datetime will be timezone-aware if USE_TZ=True.
         """
         file_metada = self.get_file_metadata(name)
-        if bool(file_metada) and hasattr(file_metada, 'Last-Modified'):
-            return timezone.make_aware(datetime.strptime(file_metada['Last-Modified'], '%a, %d %b %Y %H:%M:%S %Z'))
+        if bool(file_metada) and 'Last-Modified' in file_metada:
+            # http dates are always expressed in GMT
+            modified_time = datetime.strptime(
+                file_metada['Last-Modified'], '%a, %d %b %Y %H:%M:%S %Z'
+            ).replace(tzinfo=timezone.utc)
+            if settings.USE_TZ:
+                return modified_time
+            return timezone.make_naive(modified_time, timezone.get_default_timezone())
         return timezone.now()
 
 class RewriteToCloudinaryUrlMixin:
@@ -309,7 +676,7 @@ class RewriteToCloudinaryUrlMixin:
                     for extension, patterns in self._patterns.items():
                         if matches_patterns(path, (extension,)):
                             for pattern, template in patterns:
-                                converter = self.url_converter(name, template)
+                                converter = self.url_converter(name, template, paths=paths)
                                 try:
                                     content = pattern.sub(converter, content)
                                 except ValueError as exc:
@@ -321,10 +688,12 @@ class RewriteToCloudinaryUrlMixin:
 
                 yield name, saved_name, processed
 
-    def url_converter(self, name, template=None):
+    def url_converter(self, name, template=None, paths=None):
             """
             Return the custom URL converter for the given file name.
 
+            When paths (the mapping of collected files passed to post_process)
+            is provided, small referenced assets may be inlined as data URIs.
             """
             if template is None:
                 template = self.default_template
@@ -352,6 +721,14 @@ class RewriteToCloudinaryUrlMixin:
                     source_name = name if os.sep == '/' else name.replace(os.sep, '/')
                     target_name = posixpath.join(posixpath.dirname(source_name), url_parts.path)
 
+                # Inline small assets instead of referencing them on cloudinary.
+                # Fragments are typically used to address SVG sprites and are
+                # therefore left as regular urls.
+                if paths is not None and not url_parts.fragment:
+                    data_uri = self.data_uri(posixpath.normpath(target_name), paths)
+                    if data_uri is not None:
+                        return template % data_uri
+
                 transformed_url = self.url(target_name)
 
                 if url_parts.query:
@@ -365,9 +742,45 @@ class RewriteToCloudinaryUrlMixin:
 
             return converter
 
+    def data_uri(self, name, paths):
+        """
+        Build a data URI for the collected file name if it is allowed to be
+        inlined, i.e. it is smaller than CLOUDINARY_STORAGE['INLINE_ASSET_MAX_SIZE']
+        bytes and its mime type is listed in CLOUDINARY_STORAGE['INLINE_ASSET_MIME_TYPES'].
+
+        Arguments:
+        name(string): The name of the referenced file.
+        paths(dict): The collected files as passed to post_process.
+
+        Returns:
+        string: The data URI or None if the file should not be inlined.
+        """
+        max_size = settings.CLOUDINARY_STORAGE.get('INLINE_ASSET_MAX_SIZE', 0)
+        if not max_size:
+            return None
+        mimetype = get_mime_type(name)
+        if mimetype not in settings.CLOUDINARY_STORAGE.get('INLINE_ASSET_MIME_TYPES', INLINE_ASSET_MIME_TYPES):
+            return None
+        try:
+            storage, path = paths[name]
+        except KeyError:
+            return None
+        # read the content from the local source rather than from cloudinary
+        if storage.size(path) >= max_size:
+            return None
+        with storage.open(path) as source_file:
+            content = source_file.read()
+        # textual formats are smaller when url-encoded than when base64 encoded
+        if mimetype == 'image/svg+xml':
+            return 'data:%s,%s' % (mimetype, quote(content))
+        return 'data:%s;base64,%s' % (mimetype, base64.b64encode(content).decode('ascii'))
+
 class StaticCloudinaryStorage(RewriteToCloudinaryUrlMixin, CloudinaryStorage):
     """Cloudinary storage class for static files"""
 
+    #static files are referenced by their unversioned names in templates
+    versioned_urls = False
+
     def __init__(self, location=None, base_url=None, *args, **kwargs):
         if location is None:
             location = settings.STATIC_ROOT
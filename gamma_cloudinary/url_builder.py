@@ -0,0 +1,139 @@
+import re
+import cloudinary
+from functools import lru_cache
+from urllib.parse import unquote
+from cloudinary.utils import generate_transformation_string, smart_escape
+
+#options understood by the native url builder. Any other option is handled by the SDK.
+SUPPORTED_OPTIONS = frozenset([
+    'quality',
+    'fetch_format',
+    'width',
+    'dpr',
+    'secure',
+    'resource_type',
+    'version',
+])
+
+#transformation options and the order they are passed to the cached transformation builder
+TRANSFORMATION_OPTIONS = ('quality', 'fetch_format', 'width', 'dpr')
+
+#cloudinary configuration options that alter urls in ways the native url builder does not reproduce
+UNSUPPORTED_CONFIG = (
+    'private_cdn',
+    'cname',
+    'cdn_subdomain',
+    'secure_cdn_subdomain',
+    'sign_url',
+    'auth_token',
+    'use_root_path',
+    'shorten',
+    'responsive_width',
+    'dpr',
+    'use_fetch_format',
+)
+
+
+@lru_cache(maxsize=256, typed=True)
+def build_transformation(quality, fetch_format, width, dpr):
+    """
+    Build the transformation url segment for the given transformation options.
+
+    The SDK is used to generate the segment so the result is identical to
+    the one embedded in SDK built urls. Only the handful of distinct option
+    combinations in use are ever built thanks to the cache.
+    """
+    options = {
+        option: value for option, value in zip(TRANSFORMATION_OPTIONS, (quality, fetch_format, width, dpr))
+        if value is not None
+    }
+    transformation, _options = generate_transformation_string(**options)
+    return re.sub(r'([^:])/+', r'\1/', transformation)
+
+
+class CloudinaryUrlBuilder:
+    """
+    Builds delivery urls for uploaded resources without going through
+    cloudinary.CloudinaryResource and the SDK's generic option processing.
+
+    Only the options listed in SUPPORTED_OPTIONS are handled natively, urls
+    requiring any other option (or a cloudinary configuration the builder
+    does not reproduce e.g. signed urls or private CDNs) are built by the SDK.
+    """
+
+    def __init__(self):
+        self._configure(cloudinary.config())
+
+    def _configure(self, config):
+        """
+        Precompute the parts of the urls that only depend on the cloudinary configuration.
+        They are kept in a single attribute so that concurrent calls never see a mix of
+        two configurations.
+        """
+        native = (
+            bool(config.cloud_name)
+            and not any(getattr(config, option) for option in UNSUPPORTED_CONFIG)
+            and config.force_version is not False
+            and config.secure_distribution in (None, cloudinary.SHARED_CDN, cloudinary.OLD_AKAMAI_SHARED_CDN)
+        )
+        prefixes = {
+            True: 'https://%s/%s' % (cloudinary.SHARED_CDN, config.cloud_name),
+            False: 'http://res.cloudinary.com/%s' % config.cloud_name,
+        }
+        self._config = (dict(config.__dict__), native, config.secure, prefixes)
+
+    @property
+    def native(self):
+        """Whether urls are built natively with the current cloudinary configuration."""
+        return self._current_config()[1]
+
+    def _current_config(self):
+        config = cloudinary.config()
+        # the configuration may be changed at any time through cloudinary.config()
+        if config.__dict__ != self._config[0]:
+            self._configure(config)
+        return self._config
+
+    def build_url(self, public_id, default_resource_type='image', **options):
+        """
+        Get the delivery url of an uploaded resource
+
+        Arguments:
+        public_id(string): The public_id of the resource.
+        default_resource_type(string): The resource_type of the resource unless overridden in options.
+        options: The url and transformation options.
+
+        Returns:
+        string: The url of the resource.
+        """
+        _config, native, secure, prefixes = self._current_config()
+        if not native or not SUPPORTED_OPTIONS.issuperset(options) or not public_id \
+                or re.match(r'^https?:', public_id):
+            return cloudinary.CloudinaryResource(
+                public_id,
+                default_resource_type=default_resource_type
+            ).build_url(**options)
+
+        try:
+            transformation = build_transformation(*(options.get(option) for option in TRANSFORMATION_OPTIONS))
+        except TypeError:
+            #unhashable option values can not be cached
+            return cloudinary.CloudinaryResource(
+                public_id,
+                default_resource_type=default_resource_type
+            ).build_url(**options)
+
+        source = smart_escape(unquote(re.sub(r'([^:])/+', r'\1/', public_id)))
+
+        version = options.get('version')
+        if not version and '/' in source and not re.match(r'^v[0-9]+', source):
+            version = '1'
+
+        return '/'.join(part for part in (
+            prefixes[bool(options.get('secure', secure))],
+            options.get('resource_type') or default_resource_type,
+            'upload',
+            transformation,
+            'v%s' % version if version else None,
+            source
+        ) if part)
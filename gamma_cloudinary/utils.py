@@ -1,7 +1,9 @@
 import os
 import magic
 import mimetypes
+from django.apps import apps
 from django.core.management import call_command
+from django.contrib.staticfiles.finders import get_finders
 
 def value_or_setting(value, setting):
     return setting if value is None else value
@@ -23,6 +25,21 @@ def find_file(name):
         return filepath
     return None
 
+def find_static_files():
+    """
+    Returns the names of the static files found by the staticfiles finders
+    i.e. the files collected by collectstatic
+    """
+    ignore_patterns = list({os.path.normpath(p) for p in apps.get_app_config('staticfiles').ignore_patterns})
+    names = set()
+    for finder in get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            # Prefix the relative path if the source storage contains it
+            if getattr(storage, 'prefix', None):
+                path = os.path.join(storage.prefix, path)
+            names.add(path)
+    return names
+
 def get_resource_type(name):
         """
         Returns an appropriate resource_type based on the name of the target
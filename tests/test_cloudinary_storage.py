@@ -1,13 +1,21 @@
+import tempfile
+import threading
+from datetime import datetime, timezone
 from unittest.mock import patch
 from requests.exceptions import HTTPError
-from django.test import SimpleTestCase
+from cloudinary.exceptions import NotFound, RateLimited, AuthorizationRequired
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
 from django.core.files.base import ContentFile
+from django.core.cache import caches
+from django.core.signals import request_finished
 from gamma_cloudinary.storage import CloudinaryStorage
 from .helpers import mock_http_response
 
 class CloudinaryStorageTestCase(SimpleTestCase):
     def setUp(self):
         self.storage = CloudinaryStorage()
+        caches['default'].clear()
 
     @patch('gamma_cloudinary.storage.cloudinary.CloudinaryResource.build_url')
     def test_url(self, mocked_resource):
@@ -62,6 +70,39 @@ class CloudinaryStorageTestCase(SimpleTestCase):
 
         self.assertEqual(self.storage._save('css/test.css', ContentFile(b"these are bytes") ), 'eneivicys42bq5f2jpn2.jpg')
 
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, VERSIONED_MEDIA_URLS=True))
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test__save_returns_versioned_name_without_invalidation(self, mock_uploader):
+        mock_uploader.return_value = {
+            "public_id": "test/media/images/test",
+            "version": 1570979139,
+            "format": "jpg",
+            "resource_type": "image",
+        }
+        self.assertEqual(self.storage._save('images/test.jpg', ContentFile(b"these are bytes")), 'v1570979139/images/test.jpg')
+        self.assertFalse(mock_uploader.call_args[1]['invalidate'])
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, VERSIONED_MEDIA_URLS=True))
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test_versioned_name_fits_max_length(self, mock_uploader):
+        available_name = self.storage.get_available_name('images/%s.css' % ('a' * 78), max_length=100)
+        mock_uploader.return_value = {
+            "public_id": "test/media/%s" % available_name,
+            "version": 1570979139,
+            "format": "css",
+            "resource_type": "raw",
+        }
+        name = self.storage._save(available_name, ContentFile(b"these are bytes"))
+        self.assertEqual(name, 'v1570979139/%s' % available_name)
+        self.assertLessEqual(len(name), 100)
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, VERSIONED_MEDIA_URLS=True))
+    def test_url_uses_version_from_versioned_name(self):
+        self.assertEqual(
+            self.storage.url('v1570979139/css/test.css'),
+            'https://res.cloudinary.com/test/raw/upload/v1570979139/test/media/css/test.css'
+        )
+
     @patch('gamma_cloudinary.storage.requests.get')
     @patch('gamma_cloudinary.storage.CloudinaryStorage.url')
     def test__open_method_returns_a_file_object(self, mock_url, mock_http_get):
@@ -116,3 +157,225 @@ class CloudinaryStorageTestCase(SimpleTestCase):
             status=200,
             )
         self.assertTrue(self.storage.exists(file_name))
+
+    @patch('gamma_cloudinary.storage.requests.head')
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetch_resolves_metadata_without_per_file_requests(self, mock_resources_by_ids, mock_http_head):
+        mock_resources_by_ids.return_value = {
+            'resources': [
+                {'public_id': 'test/media/images/test', 'bytes': 350749, 'created_at': '2017-08-11T12:24:32Z'},
+                {'public_id': 'test/media/css/test.css', 'bytes': 120, 'created_at': '2017-08-11T12:24:32Z'},
+            ]
+        }
+        self.storage.prefetch(['images/test.jpg', 'css/test.css', 'css/missing.css'])
+
+        self.assertEqual(mock_resources_by_ids.call_count, 2)
+        self.assertEqual(self.storage.size('images/test.jpg'), 350749)
+        self.assertEqual(self.storage.size('css/test.css'), 120)
+        self.assertEqual(self.storage.get_modified_time('css/test.css').year, 2017)
+        self.assertTrue(self.storage.exists('images/test.jpg'))
+        self.assertFalse(self.storage.exists('css/missing.css'))
+        mock_http_head.assert_not_called()
+
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetch_resolves_names_sharing_a_public_id(self, mock_resources_by_ids):
+        mock_resources_by_ids.return_value = {
+            'resources': [
+                {'public_id': 'test/media/images/test', 'bytes': 350749, 'created_at': '2017-08-11T12:24:32Z'},
+            ]
+        }
+        self.storage.prefetch(['images/test.jpg', 'images/test.png'])
+
+        self.assertEqual(mock_resources_by_ids.call_args[0][0], ['test/media/images/test'])
+        self.assertEqual(self.storage.size('images/test.jpg'), 350749)
+        self.assertEqual(self.storage.size('images/test.png'), 350749)
+
+    @override_settings(USE_TZ=True)
+    @patch('gamma_cloudinary.storage.CloudinaryStorage.get_file_metadata')
+    def test_get_modified_time_is_aware_utc_with_use_tz(self, mock_get_file_metadata):
+        mock_get_file_metadata.return_value = {'Last-Modified': 'Fri, 11 Aug 2017 12:24:32 GMT'}
+        self.assertEqual(
+            self.storage.get_modified_time('css/test.css'),
+            datetime(2017, 8, 11, 12, 24, 32, tzinfo=timezone.utc)
+        )
+
+    @override_settings(USE_TZ=False, TIME_ZONE='Africa/Nairobi')
+    @patch('gamma_cloudinary.storage.CloudinaryStorage.get_file_metadata')
+    def test_get_modified_time_is_naive_local_time_without_use_tz(self, mock_get_file_metadata):
+        mock_get_file_metadata.return_value = {'Last-Modified': 'Fri, 11 Aug 2017 12:24:32 GMT'}
+        self.assertEqual(self.storage.get_modified_time('css/test.css'), datetime(2017, 8, 11, 15, 24, 32))
+
+    @patch('gamma_cloudinary.storage.requests.head')
+    def test_size_falls_back_to_the_untransformed_original(self, mock_http_head):
+        mock_http_head.return_value = mock_http_response(status=200)
+        mock_http_head.return_value.headers = {'Content-Length': '350749'}
+
+        self.assertEqual(self.storage.size('images/test.jpg'), 350749)
+        url = mock_http_head.call_args[0][0]
+        self.assertNotIn('q_auto', url)
+        self.assertNotIn('f_auto', url)
+
+    @patch('gamma_cloudinary.storage.requests.Session.head')
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetch_falls_back_to_concurrent_head_requests(self, mock_resources_by_ids, mock_session_head):
+        mock_resources_by_ids.side_effect = RateLimited('Rate limit exceeded')
+        mock_session_head.return_value = mock_http_response(status=404)
+        self.storage.prefetch(['css/test.css', 'css/other.css'])
+
+        self.assertEqual(mock_session_head.call_count, 2)
+        self.assertFalse(self.storage.exists('css/test.css'))
+        self.assertFalse(self.storage.exists('css/other.css'))
+
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetched_metadata_is_discarded_when_the_request_finishes(self, mock_resources_by_ids):
+        mock_resources_by_ids.return_value = {'resources': []}
+        self.storage.prefetch(['css/test.css'])
+        self.assertIn('css/test.css', self.storage._prefetched_metadata)
+
+        request_finished.send(sender=self.__class__)
+        self.assertNotIn('css/test.css', self.storage._prefetched_metadata)
+
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetched_metadata_is_local_to_the_thread(self, mock_resources_by_ids):
+        mock_resources_by_ids.return_value = {'resources': []}
+        prefetched = threading.Event()
+        checked = threading.Event()
+        seen = {}
+
+        def request():
+            self.storage.prefetch(['css/test.css'])
+            prefetched.set()
+            checked.wait(5)
+            seen['before'] = 'css/test.css' in self.storage._prefetched_metadata
+            request_finished.send(sender=self.__class__)
+            seen['after'] = 'css/test.css' in self.storage._prefetched_metadata
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        prefetched.wait(5)
+        seen['other_thread'] = 'css/test.css' in self.storage._prefetched_metadata
+        checked.set()
+        thread.join(5)
+
+        self.assertEqual(seen, {'other_thread': False, 'before': True, 'after': False})
+
+    @patch('gamma_cloudinary.storage.cloudinary.api.resources_by_ids')
+    def test_prefetched_metadata_is_discarded_at_the_end_of_the_block(self, mock_resources_by_ids):
+        mock_resources_by_ids.return_value = {'resources': []}
+        with self.storage.prefetched(['css/test.css']):
+            self.assertFalse(self.storage.exists('css/test.css'))
+        self.assertNotIn('css/test.css', self.storage._prefetched_metadata)
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, METADATA_CACHE='default'))
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test_image_dimensions_are_served_from_upload_metadata(self, mock_uploader, mock_resource):
+        mock_uploader.return_value = {
+            "public_id": "test/media/images/upload",
+            "version": 1570979139,
+            "width": 1000,
+            "height": 672,
+            "format": "jpg",
+            "bytes": 350749,
+            "resource_type": "image",
+        }
+        name = self.storage._save('images/upload.jpg', ContentFile(b"these are bytes"))
+
+        self.assertEqual(self.storage.get_image_dimensions(name), (1000, 672))
+        self.assertEqual(self.storage.get_upload_metadata(name)['bytes'], 350749)
+        mock_resource.assert_not_called()
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, METADATA_CACHE='default'))
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    def test_image_dimensions_fall_back_to_the_admin_api(self, mock_resource):
+        mock_resource.return_value = {"width": 400, "height": 300, "format": "png", "bytes": 1024}
+
+        self.assertEqual(self.storage.get_image_dimensions('images/fallback.png'), (400, 300))
+        self.assertEqual(self.storage.get_image_dimensions('images/fallback.png'), (400, 300))
+        mock_resource.assert_called_once_with('test/media/images/fallback', resource_type='image')
+
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    def test_image_dimensions_are_unknown_without_a_metadata_cache(self, mock_resource):
+        self.assertEqual(self.storage.get_image_dimensions('images/test.png'), (None, None))
+        mock_resource.assert_not_called()
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, METADATA_CACHE='default'))
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    def test_image_dimensions_of_missing_files_are_unknown(self, mock_resource):
+        mock_resource.side_effect = NotFound('Resource not found')
+        self.assertEqual(self.storage.get_image_dimensions('images/missing.png'), (None, None))
+        self.assertEqual(self.storage.get_image_dimensions('images/missing.png'), (None, None))
+        mock_resource.assert_called_once()
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, METADATA_CACHE='default'))
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test_uploads_replace_cached_missing_metadata(self, mock_uploader, mock_resource):
+        mock_resource.side_effect = NotFound('Resource not found')
+        self.assertEqual(self.storage.get_image_dimensions('images/upload.jpg'), (None, None))
+
+        mock_uploader.return_value = {
+            "public_id": "test/media/images/upload",
+            "width": 1000,
+            "height": 672,
+            "format": "jpg",
+            "bytes": 350749,
+            "resource_type": "image",
+        }
+        name = self.storage._save('images/upload.jpg', ContentFile(b"these are bytes"))
+        self.assertEqual(self.storage.get_image_dimensions(name), (1000, 672))
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, METADATA_CACHE='default'))
+    @patch('gamma_cloudinary.storage.cloudinary.api.resource')
+    def test_image_dimensions_are_unknown_when_the_admin_api_fails(self, mock_resource):
+        for error in (RateLimited('Rate limit exceeded'), AuthorizationRequired('Invalid credentials')):
+            with self.subTest(error=error):
+                mock_resource.side_effect = error
+                self.assertEqual(self.storage.get_image_dimensions('images/unavailable.png'), (None, None))
+
+    @patch('gamma_cloudinary.storage.requests.get')
+    def test__open_revalidates_cached_files(self, mock_http_get):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, OPEN_CACHE_DIR=directory)):
+                storage = CloudinaryStorage()
+                response = mock_http_response(content=b'Random words from request')
+                response.headers = {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+                mock_http_get.return_value = response
+                self.assertEqual(storage._open('css/test.css').read(), b'Random words from request')
+
+                mock_http_get.return_value = mock_http_response(status=304)
+                self.assertEqual(storage._open('css/test.css').read(), b'Random words from request')
+                self.assertEqual(mock_http_get.call_args[1]['headers'], {
+                    'If-None-Match': '"abc"',
+                    'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+                })
+
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test_save_from_url_lets_cloudinary_fetch_the_remote_file(self, mock_uploader):
+        mock_uploader.return_value = {
+            "public_id": "test/media/images/remote",
+            "version": 1570979139,
+            "width": 1000,
+            "height": 672,
+            "format": "jpg",
+            "bytes": 350749,
+            "resource_type": "image",
+        }
+        name = self.storage.save_from_url('images/remote.jpg', 'https://example.com/photo.jpg')
+
+        self.assertEqual(name, 'images/remote.jpg')
+        mock_uploader.assert_called_once_with(
+            'https://example.com/photo.jpg',
+            public_id='remote',
+            resource_type='image',
+            overwrite=True,
+            invalidate=True,
+            folder='test/media/images'
+        )
+
+    @patch('gamma_cloudinary.storage.cloudinary.uploader.upload')
+    def test_save_from_url_rejects_local_paths(self, mock_uploader):
+        for url in ('/app/.env', 'file:///etc/passwd', 'ftp://example.com/photo.jpg'):
+            with self.subTest(url=url):
+                self.assertRaises(ValueError, self.storage.save_from_url, 'files/test.txt', url)
+        mock_uploader.assert_not_called()
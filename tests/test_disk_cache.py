@@ -0,0 +1,43 @@
+import os
+import time
+import tempfile
+from django.test import SimpleTestCase
+from gamma_cloudinary.disk_cache import DiskCache
+
+
+class DiskCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.directory.name, max_size=1024)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_returns_the_cached_content_and_validators(self):
+        self.cache.set('https://res.cloudinary.com/test/raw/upload/v1/test.css', b'content', {'ETag': '"abc"'})
+        self.assertEqual(
+            self.cache.get('https://res.cloudinary.com/test/raw/upload/v1/test.css'),
+            ({'ETag': '"abc"'}, b'content')
+        )
+
+    def test_get_returns_none_for_missing_entries(self):
+        self.assertIsNone(self.cache.get('https://res.cloudinary.com/test/raw/upload/v1/missing.css'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.set('first', b'a' * 400, {})
+        self.cache.set('second', b'b' * 400, {})
+        # make the first entry the most recently used one
+        past = time.time() - 60
+        os.utime(self.cache.path('second'), (past, past))
+        self.cache.get('first')
+        self.cache.set('third', b'c' * 400, {})
+
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('third'))
+
+    def test_entries_larger_than_the_cache_are_not_stored(self):
+        self.cache.set('large', b'a' * 2048, {})
+        self.assertIsNone(self.cache.get('large'))
+        self.assertEqual(os.listdir(self.directory.name), [])
@@ -0,0 +1,29 @@
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from gamma_cloudinary.storage import CloudinaryStorage
+from gamma_cloudinary.fields import CloudinaryImageField, CloudinaryImageFieldFile
+
+
+class CloudinaryImageFieldFileTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.field = CloudinaryImageField(storage=CloudinaryStorage())
+
+    @patch('gamma_cloudinary.storage.CloudinaryStorage._open')
+    @patch('gamma_cloudinary.storage.CloudinaryStorage.get_image_dimensions')
+    def test_dimensions_do_not_download_the_image(self, mock_dimensions, mock_open):
+        mock_dimensions.return_value = (1000, 672)
+        image = CloudinaryImageFieldFile(None, self.field, 'images/test.jpg')
+
+        self.assertEqual((image.width, image.height), (1000, 672))
+        mock_dimensions.assert_called_once_with('images/test.jpg')
+        mock_open.assert_not_called()
+
+    @patch('gamma_cloudinary.storage.CloudinaryStorage.get_image_dimensions')
+    def test_dimensions_fall_back_to_reading_the_image_when_unknown(self, mock_dimensions):
+        mock_dimensions.return_value = (None, None)
+        image = CloudinaryImageFieldFile(None, self.field, 'images/test.jpg')
+
+        with patch('django.db.models.fields.files.ImageFieldFile._get_image_dimensions', return_value=(10, 20)) as mock_super:
+            self.assertEqual((image.width, image.height), (10, 20))
+        mock_super.assert_called()
@@ -0,0 +1,100 @@
+import os
+import json
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+
+def mock_resources(resource_type='image', **options):
+    resources = {
+        'image': ['test/static/images/placeholder', 'test/static/images/old'],
+        'video': [],
+        'raw': ['test/static/css/foo.css', 'test/static/css/old.css'],
+    }
+    return {'resources': [{'public_id': public_id} for public_id in resources[resource_type]]}
+
+def mock_delete_resources(public_ids, **options):
+    return {'deleted': {public_id: 'deleted' for public_id in public_ids}}
+
+
+@patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.resources', side_effect=mock_resources)
+class PruneCloudinaryCommandTestCase(SimpleTestCase):
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources')
+    def test_dry_run_lists_orphans_without_deleting(self, mock_delete, mock_list):
+        out = StringIO()
+        call_command('prune_cloudinary', dry_run=True, stdout=out)
+
+        mock_delete.assert_not_called()
+        self.assertIn('Orphaned test/static/images/old (image)', out.getvalue())
+        self.assertIn('Orphaned test/static/css/old.css (raw)', out.getvalue())
+        self.assertNotIn('test/static/css/foo.css', out.getvalue())
+        self.assertIn('2 orphaned assets found.', out.getvalue())
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources', side_effect=mock_delete_resources)
+    def test_orphans_are_deleted_in_batches_per_resource_type(self, mock_delete, mock_list):
+        out = StringIO()
+        call_command('prune_cloudinary', interactive=False, stdout=out)
+
+        deleted = {call[1]['resource_type']: call[0][0] for call in mock_delete.call_args_list}
+        self.assertEqual(deleted, {'image': ['test/static/images/old'], 'raw': ['test/static/css/old.css']})
+        self.assertIn('2 orphaned assets deleted.', out.getvalue())
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources', side_effect=mock_delete_resources)
+    def test_pruning_resumes_from_the_state_file(self, mock_delete, mock_list):
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            with open(state_file, 'w') as f:
+                json.dump({
+                    'orphans': {'raw': ['test/static/css/old.css', 'test/static/css/older.css']},
+                    'deleted': {'raw': ['test/static/css/old.css']},
+                }, f)
+            call_command('prune_cloudinary', state_file=state_file, interactive=False, stdout=StringIO())
+
+            mock_list.assert_not_called()
+            mock_delete.assert_called_once_with(['test/static/css/older.css'], resource_type='raw')
+            self.assertFalse(os.path.exists(state_file))
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources')
+    def test_failed_deletions_keep_the_state_file_for_resuming(self, mock_delete, mock_list):
+        mock_delete.return_value = {'deleted': {'test/static/images/old': 'deleted'}}
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            with self.assertRaises(CommandError):
+                call_command('prune_cloudinary', state_file=state_file, workers=1, interactive=False, stdout=StringIO())
+
+            with open(state_file) as f:
+                state = json.load(f)
+            self.assertIn('test/static/images/old', state['deleted']['image'])
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources', side_effect=mock_delete_resources)
+    def test_resumed_orphans_that_now_exist_locally_are_not_deleted(self, mock_delete, mock_list):
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            with open(state_file, 'w') as f:
+                json.dump({
+                    'orphans': {'raw': ['test/static/css/foo.css', 'test/static/css/old.css']},
+                    'deleted': {},
+                }, f)
+            call_command('prune_cloudinary', state_file=state_file, interactive=False, stdout=StringIO())
+
+            mock_delete.assert_called_once_with(['test/static/css/old.css'], resource_type='raw')
+
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.input', create=True, return_value='no')
+    @patch('gamma_cloudinary.management.commands.prune_cloudinary.cloudinary.api.delete_resources')
+    def test_deletion_is_cancelled_unless_confirmed(self, mock_delete, mock_input, mock_list):
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            with self.assertRaisesMessage(CommandError, 'Pruning cancelled.'):
+                call_command('prune_cloudinary', state_file=state_file, stdout=StringIO())
+            # a cancelled run must not be resumed by the next one
+            self.assertFalse(os.path.exists(state_file))
+        mock_input.assert_called_once()
+        mock_delete.assert_not_called()
+
+    def test_batch_size_is_limited_to_the_api_maximum(self, mock_list):
+        with self.assertRaises(CommandError):
+            call_command('prune_cloudinary', batch_size=101, stdout=StringIO())
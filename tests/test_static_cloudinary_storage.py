@@ -62,3 +62,33 @@ class StaticCloudinaryStorageTestCase(SimpleTestCase):
             'url(https://gammaadvocates.com/staticfiles/css/random.css?t=56#test)'
             )
 
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, INLINE_ASSET_MAX_SIZE=200000))
+    def test_url_converter_inlines_small_assets_as_data_uris(self):
+        pattern = re.compile(r"""(url\(['"]{0,1}\s*(.*?)["']{0,1}\))""", re.IGNORECASE)
+        name = 'css/foo.css'
+        content = "url('../images/placeholder.png')"
+        converter = self.storage.url_converter(name, paths=find_files())
+
+        self.assertTrue(pattern.sub(converter, content).startswith('url("data:image/png;base64,iVBORw0KGgo'))
+
+    @override_settings(CLOUDINARY_STORAGE=dict(settings.CLOUDINARY_STORAGE, INLINE_ASSET_MAX_SIZE=1024))
+    def test_url_converter_does_not_inline_assets_above_the_size_threshold(self):
+        pattern = re.compile(r"""(url\(['"]{0,1}\s*(.*?)["']{0,1}\))""", re.IGNORECASE)
+        name = 'css/foo.css'
+        content = "url('../images/placeholder.png')"
+        converter = self.storage.url_converter(name, paths=find_files())
+
+        self.assertTrue(pattern.sub(converter, content).startswith('url("https://res.cloudinary.com/test/image/upload/'))
+
+    @override_settings(CLOUDINARY_STORAGE=dict(
+        settings.CLOUDINARY_STORAGE,
+        INLINE_ASSET_MAX_SIZE=200000,
+        INLINE_ASSET_MIME_TYPES=('image/svg+xml',)
+    ))
+    def test_url_converter_does_not_inline_disallowed_mime_types(self):
+        pattern = re.compile(r"""(url\(['"]{0,1}\s*(.*?)["']{0,1}\))""", re.IGNORECASE)
+        name = 'css/foo.css'
+        content = "url('../images/placeholder.png')"
+        converter = self.storage.url_converter(name, paths=find_files())
+
+        self.assertNotIn('data:', pattern.sub(converter, content))
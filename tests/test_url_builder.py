@@ -0,0 +1,72 @@
+import random
+import cloudinary
+from django.test import SimpleTestCase
+from gamma_cloudinary.url_builder import CloudinaryUrlBuilder
+
+PUBLIC_IDS = [
+    'test',
+    'test/media/images/test.jpg',
+    'test/static/css/test.css',
+    'test//static///css/test.css',
+    'v2/images/test.jpg',
+    'test/media/images/with space.jpg',
+    'test/media/images/with%20space.jpg',
+    'test/media/images/ünïcödé.png',
+    'test/media/files/a+b&c=d?e#f.pdf',
+]
+
+OPTION_VALUES = {
+    'quality': ['auto', 'auto:good', 'best', 80, 0],
+    'fetch_format': ['auto', 'webp', 'avif'],
+    'width': ['auto', 'auto:100', 300, '300', 0.5],
+    'dpr': ['auto', 2, 2.0, '1.5'],
+    'secure': [True, False, None],
+    'resource_type': ['image', 'video', 'raw'],
+    'version': [1570979139, '1570979139', None, 0],
+}
+
+
+class CloudinaryUrlBuilderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.builder = CloudinaryUrlBuilder()
+
+    def sdk_url(self, public_id, default_resource_type, **options):
+        return cloudinary.CloudinaryResource(public_id, default_resource_type=default_resource_type).build_url(**options)
+
+    def test_native_urls_are_identical_to_sdk_urls(self):
+        self.assertTrue(self.builder.native)
+        generator = random.Random(2021)
+        for _i in range(2000):
+            public_id = generator.choice(PUBLIC_IDS)
+            resource_type = generator.choice(['image', 'video', 'raw'])
+            options = {
+                option: generator.choice(values) for option, values in OPTION_VALUES.items()
+                if generator.random() < 0.5
+            }
+            with self.subTest(public_id=public_id, default_resource_type=resource_type, options=options):
+                self.assertEqual(
+                    self.builder.build_url(public_id, default_resource_type=resource_type, **options),
+                    self.sdk_url(public_id, resource_type, **options)
+                )
+
+    def test_unsupported_options_are_built_by_the_sdk(self):
+        options = {'crop': 'fill', 'width': 300, 'height': 200}
+        self.assertEqual(
+            self.builder.build_url('test/media/images/test.jpg', default_resource_type='image', **options),
+            self.sdk_url('test/media/images/test.jpg', 'image', **options)
+        )
+
+    def test_urls_follow_cloudinary_configuration_changes(self):
+        self.builder.build_url('test/media/images/test.jpg')
+        secure = cloudinary.config().secure
+        try:
+            for config in ({'secure': not secure}, {'cloud_name': 'other'}, {'private_cdn': True}):
+                with self.subTest(config=config):
+                    cloudinary.config(**config)
+                    self.assertEqual(
+                        self.builder.build_url('test/media/images/test.jpg', quality='auto'),
+                        self.sdk_url('test/media/images/test.jpg', 'image', quality='auto')
+                    )
+        finally:
+            cloudinary.config(secure=secure, cloud_name='test', private_cdn=None)
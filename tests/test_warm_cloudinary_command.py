@@ -0,0 +1,65 @@
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from django.core.management import call_command
+from gamma_cloudinary.utils import find_static_files
+from .helpers import mock_http_response
+
+
+def mock_get(url, headers=None, timeout=None, stream=False):
+    response = mock_http_response(status=200)
+    response.__enter__ = lambda self: self
+    response.__exit__ = lambda self, *args: None
+    response.iter_content = lambda chunk_size: iter([b'body'])
+    response.headers = {'X-Cache': 'MISS, HIT' if 'cached' in url else 'MISS'}
+    return response
+
+
+@patch('gamma_cloudinary.management.commands.warm_cloudinary.requests.Session.get', side_effect=mock_get)
+class WarmCloudinaryCommandTestCase(SimpleTestCase):
+
+    def test_static_files_are_warmed(self, mock_session_get):
+        out = StringIO()
+        call_command('warm_cloudinary', rate=0, stdout=out)
+
+        urls = {call[0][0] for call in mock_session_get.call_args_list}
+        self.assertEqual(len(urls), len(find_static_files()))
+        self.assertIn('https://res.cloudinary.com/test/raw/upload/v1/test/static/css/foo.css', urls)
+
+    def test_f_auto_urls_are_warmed_for_every_accept_header(self, mock_session_get):
+        with tempfile.TemporaryDirectory() as directory:
+            access_log = os.path.join(directory, 'access.log')
+            with open(access_log, 'w') as f:
+                f.write(
+                    '1.1.1.1 - - "GET https://res.cloudinary.com/test/image/upload/f_auto,q_auto/v1/test/media/cached.jpg HTTP/1.1" 200\n'
+                    '1.1.1.1 - - "GET https://res.cloudinary.com/test/raw/upload/v1/test/static/css/foo.css HTTP/1.1" 200\n'
+                )
+            out = StringIO()
+            call_command(
+                'warm_cloudinary', '--no-static', access_log=[access_log],
+                accept=['image/avif', 'image/webp'], rate=0, stdout=out
+            )
+
+        requests_sent = sorted((call[0][0], call[1]['headers'].get('Accept')) for call in mock_session_get.call_args_list)
+        self.assertEqual(requests_sent, [
+            ('https://res.cloudinary.com/test/image/upload/f_auto,q_auto/v1/test/media/cached.jpg', 'image/avif'),
+            ('https://res.cloudinary.com/test/image/upload/f_auto,q_auto/v1/test/media/cached.jpg', 'image/webp'),
+            ('https://res.cloudinary.com/test/raw/upload/v1/test/static/css/foo.css', None),
+        ])
+        self.assertIn('3 requests: 2 hits, 1 misses, 0 errors.', out.getvalue())
+
+    def test_option_sets_are_only_applied_to_images(self, mock_session_get):
+        with tempfile.TemporaryDirectory() as directory:
+            options_file = os.path.join(directory, 'options.json')
+            with open(options_file, 'w') as f:
+                f.write('[{"width": 300}, {"width": 600}]')
+            call_command('warm_cloudinary', options=options_file, rate=0, stdout=StringIO())
+
+        urls = {call[0][0] for call in mock_session_get.call_args_list}
+        self.assertIn('https://res.cloudinary.com/test/raw/upload/v1/test/static/css/foo.css', urls)
+        self.assertIn('https://res.cloudinary.com/test/image/upload/dpr_auto,f_auto,q_auto,w_300/v1/test/static/images/placeholder.png', urls)
+        self.assertIn('https://res.cloudinary.com/test/image/upload/dpr_auto,f_auto,q_auto,w_600/v1/test/static/images/placeholder.png', urls)
+        self.assertFalse([url for url in urls if '/raw/upload/' in url and 'w_' in url])
+        self.assertTrue(all(call[1]['stream'] for call in mock_session_get.call_args_list))